@@ -7,7 +7,18 @@ def weight_dev(port_weights, target_weights):
         port_weights: current weights in portfolio
         target_weights: weights we want to adjust port_weights to
     '''
-    return np.sum(np.square(np.subtract(port_weights, target_weights)))
+    weight_diff_list = np.subtract(port_weights, target_weights)
+    return float(weight_diff_list @ weight_diff_list) # Sum of squares as one dot product
+
+def weight_dev_with_grad(port_weights, target_weights):
+    '''
+    Function to calculate weight_dev and its gradient with respect to port_weights in one pass
+    (Passed to optimizer with jac=True so value and gradient share the same weight difference)
+        port_weights: current weights in portfolio
+        target_weights: weights we want to adjust port_weights to
+    '''
+    weight_diff_list = np.subtract(port_weights, target_weights)
+    return float(weight_diff_list @ weight_diff_list), 2.0 * weight_diff_list
 
 def total_trading_cost(curr_weights, adj_weights, prices, total_holdings, trading_rate): 
     '''
@@ -18,17 +29,9 @@ def total_trading_cost(curr_weights, adj_weights, prices, total_holdings, tradin
         total_holdings: total holdings in portfolio
         trading_rate: rate/fee for stock transaction
     '''
-    # Get difference between current weight and target weight
-    weight_diff_list = np.subtract(adj_weights, curr_weights)
-    
-    # Multiply weight differences by total number of shares to buy/sell in portfolio
-    units_exchange_list = weight_diff_list * total_holdings
-
-    # Convert exchange units to prices/amounts
-    amt_exchange_list = np.multiply(units_exchange_list, prices)
-
-    # Calculate trading costs/fees for each transaction
-    trading_fees = np.absolute(amt_exchange_list * trading_rate) # Calculate fee for every transaction
-    total_fee = np.sum(trading_fees) # Get total of all transaction fees
+    # Fee of each transaction is |weight diff| * total_holdings * price * trading_rate;
+    # prices are positive, so the constants are factored out of the abs and summed with one dot product
+    total_fee = total_holdings * trading_rate * (np.abs(np.subtract(adj_weights, curr_weights)) @ prices)
 
     return total_fee
+
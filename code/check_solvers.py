@@ -0,0 +1,142 @@
+import pandas as pd
+from calculation import weight_dev_with_grad
+from optimizer import optimize_holdings, optimize_holdings_batch, project_holdings, solve_holdings_qp, quadprog
+import numpy as np
+import glob
+import sys
+import os
+
+
+def load_testcase(portfolio_name):
+    '''
+    Load a portfolio CSV and compute optimizer inputs the same way as main.py
+        portfolio_name: csv filename for stock portfolio
+    Returns (curr_weights, target_weights, prices, total_holdings)
+    '''
+    stock_portfolio_df = pd.read_csv(portfolio_name)
+    prices = stock_portfolio_df["t1_stock_price"].to_numpy(dtype=np.float64)
+    units_held = stock_portfolio_df["units_held"].to_numpy(dtype=np.float64)
+    target_weights = stock_portfolio_df["target_weight"].to_numpy(dtype=np.float64)
+    curr_market_vals = prices * units_held
+    return curr_market_vals / curr_market_vals.sum(), target_weights, prices, units_held.sum()
+
+
+def random_portfolio(rng, num_stocks, zero_targets=False):
+    '''
+    Generate random optimizer inputs
+        rng: np.random.Generator
+        num_stocks: number of stocks in portfolio
+        zero_targets: if True, about half of the target weights are 0
+    Returns (curr_weights, target_weights, prices, total_holdings)
+    '''
+    curr_weights = rng.dirichlet(np.ones(num_stocks))
+    target_weights = rng.dirichlet(np.ones(num_stocks))
+    if zero_targets:
+        target_weights[rng.random(num_stocks) < 0.5] = 0.0
+        target_weights[0] += 1e-3 # Make sure at least one target weight is positive
+        target_weights /= target_weights.sum()
+    return curr_weights, target_weights, rng.uniform(1.0, 500.0, num_stocks), rng.uniform(1e3, 1e5)
+
+
+def check_feasible(adj_weights, curr_weights, scaled_prices, cons_trading_limit, label):
+    '''
+    Check adjusted weights sum up to 1, are within [0, 1] and do not exceed the trade limit
+    '''
+    assert abs(adj_weights.sum() - 1.0) <= 1e-9, f"{label}: weights sum up to {adj_weights.sum()}"
+    assert adj_weights.min() >= 0.0 and adj_weights.max() <= 1.0, f"{label}: weights outside [0, 1]"
+    trade_cost = np.abs(adj_weights - curr_weights) @ scaled_prices
+    assert trade_cost <= max(cons_trading_limit, 0.0) * (1 + 1e-8) + 1e-8, \
+        f"{label}: trading cost {trade_cost} exceeds limit {cons_trading_limit}"
+
+
+def check_portfolio(curr_weights, target_weights, prices, total_holdings, cons_trading_limit, trading_rate, label):
+    '''
+    Solve one portfolio with project_holdings (via optimize_holdings and directly), SLSQP and quadprog
+    (if installed), and check that all solutions are feasible and agree with each other
+    '''
+    scaled_prices = prices * total_holdings * trading_rate
+    full_trade_cost = np.abs(target_weights - curr_weights) @ scaled_prices
+
+    proj_weights = optimize_holdings(None, curr_weights, target_weights, prices, total_holdings,
+                                     cons_trading_limit, trading_rate, 0.0)
+    check_feasible(proj_weights, curr_weights, scaled_prices, cons_trading_limit, label)
+
+    # Limit cases have known answers
+    if (cons_trading_limit <= 0):
+        assert np.allclose(proj_weights, curr_weights, rtol=0.0, atol=1e-12), f"{label}: expected current weights"
+    if (cons_trading_limit >= full_trade_cost):
+        assert np.allclose(proj_weights, target_weights, rtol=0.0, atol=1e-12), f"{label}: expected target weights"
+
+    # project_holdings called directly (no early exits in optimize_holdings) must give the same answer
+    direct_weights = project_holdings(curr_weights, target_weights, scaled_prices, cons_trading_limit, 0.0)
+    assert np.allclose(direct_weights, proj_weights, rtol=0.0, atol=1e-9), f"{label}: project_holdings differs"
+
+    # SLSQP must reach the same weight deviation (up to its tolerance), not stop at the starting point
+    slsqp_weights = optimize_holdings(weight_dev_with_grad, curr_weights, target_weights, prices, total_holdings,
+                                      cons_trading_limit, trading_rate, 1e-10, min_func_jac=True, method='SLSQP')
+    check_feasible(slsqp_weights, curr_weights, scaled_prices, cons_trading_limit, label + " (SLSQP)")
+    proj_dev = np.sum(np.square(proj_weights - target_weights))
+    slsqp_dev = np.sum(np.square(slsqp_weights - target_weights))
+    assert slsqp_dev <= proj_dev * (1 + 1e-5) + 1e-12, f"{label}: weight deviation {proj_dev} vs SLSQP {slsqp_dev}"
+
+    if quadprog is not None:
+        qp_weights = solve_holdings_qp(curr_weights, target_weights, scaled_prices, cons_trading_limit)
+        check_feasible(qp_weights, curr_weights, scaled_prices, cons_trading_limit, label + " (quadprog)")
+        qp_dev = np.sum(np.square(qp_weights - target_weights))
+        assert abs(proj_dev - qp_dev) <= 1e-9, f"{label}: weight deviation {proj_dev} vs quadprog {qp_dev}"
+        assert np.allclose(proj_weights, qp_weights, rtol=0.0, atol=1e-6), f"{label}: weights differ from quadprog"
+
+    return proj_weights
+
+
+def main():
+    '''
+    Check Method (run as: python3 code/check_solvers.py [--numba]):
+    - Solves the testcases/ portfolios and random portfolios (including zero target weights,
+      limit <= 0 and limit >= full rebalance cost) with every solver and checks answers agree
+    - Checks the batch solver gives the same answers as solving each portfolio one by one
+      (with --numba, also checks the numba compiled batch solver)
+    '''
+    trading_rate = 0.03
+    rng = np.random.default_rng(0)
+    if quadprog is None:
+        print("quadprog is not installed; skipping comparisons with solve_holdings_qp")
+
+    # Sample portfolios from testcases/, with the README limit and a range of tighter/looser limits
+    testcase_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "testcases")
+    for portfolio_name in sorted(glob.glob(os.path.join(testcase_dir, "*.csv"))):
+        curr_weights, target_weights, prices, total_holdings = load_testcase(portfolio_name)
+        for cons_trading_limit in (7500.0, 0.0, -1.0, 100.0, 1e9):
+            check_portfolio(curr_weights, target_weights, prices, total_holdings, cons_trading_limit, trading_rate,
+                            f"{os.path.basename(portfolio_name)} limit={cons_trading_limit}")
+    print("Checked testcases/ portfolios")
+
+    # Random portfolios, collected into batches of the same size
+    batches = {}
+    for index in range(300):
+        num_stocks = int(rng.integers(2, 30))
+        curr_weights, target_weights, prices, total_holdings = random_portfolio(rng, num_stocks, zero_targets=(index % 3 == 0))
+        full_trade_cost = np.abs(target_weights - curr_weights) @ (prices * total_holdings * trading_rate)
+        cons_trading_limit = full_trade_cost * [0.0, -0.5, 1.0, 2.0, *rng.uniform(0.01, 0.99, 6)][index % 10]
+        proj_weights = check_portfolio(curr_weights, target_weights, prices, total_holdings, cons_trading_limit,
+                                       trading_rate, f"random portfolio {index}")
+
+        batch = batches.setdefault(num_stocks, {"curr": [], "target": [], "prices": [], "holdings": [], "limit": [], "answer": []})
+        for key, value in zip(batch, (curr_weights, target_weights, prices, total_holdings, cons_trading_limit, proj_weights)):
+            batch[key].append(value)
+    print("Checked random portfolios")
+
+    use_numba_options = (False, True) if "--numba" in sys.argv[1:] else (False,)
+    for use_numba in use_numba_options:
+        for num_stocks, batch in batches.items():
+            batch_weights = optimize_holdings_batch(np.array(batch["curr"]), np.array(batch["target"]), np.array(batch["prices"]),
+                                                    np.array(batch["holdings"]), np.array(batch["limit"]), trading_rate, 0.0,
+                                                    use_numba=use_numba)
+            assert np.allclose(batch_weights, np.array(batch["answer"]), rtol=0.0, atol=1e-9), \
+                f"batch of {num_stocks} stocks (use_numba={use_numba}) differs from single portfolio answers"
+        print(f"Checked batch solver (use_numba={use_numba})")
+
+    print("All solver checks passed")
+
+if __name__ == '__main__':
+    main()
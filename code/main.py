@@ -1,22 +1,23 @@
 import pandas as pd
-from calculation import total_trading_cost, weight_dev
+from calculation import total_trading_cost, weight_dev_with_grad
 from optimizer import optimize_holdings
 import numpy as np
+import math
 import sys
 
 
-def validate_port_target_vals(stock_portfolio_data):
+def validate_port_target_vals(stock_portfolio_data, tol=1e-9):
     '''
-    Checks if portfolio target values do sum up to 1.
-    If so, resume program; otherwise, print error and stop program
-        stock_portfolio_data: list of stock data; each stock in list is in form of dictionary
-
+    Checks if portfolio target values do sum up to 1 (within tol).
+    If so, return target weights as np.array; otherwise, print error and stop program
+        stock_portfolio_data: DataFrame of stock data; each row is a stock
+        tol: absolute tolerance allowed when comparing sum of target weights to 1.0
     '''
-    check_sum = 0.0
-    for stock in stock_portfolio_data:
-        check_sum += stock["target_weight"]
-    if (check_sum != 1.0):
+    target_weights = stock_portfolio_data["target_weight"].to_numpy(dtype=np.float64)
+    check_sum = target_weights.sum() # NumPy uses pairwise summation, so rounding error stays well below tol
+    if not math.isclose(check_sum, 1.0, abs_tol=tol):
         raise Exception(f"ERROR: target_weights in portfolio do not add up to 1.0\nCurrently sums up to: {check_sum}")
+    return target_weights
 
 
 def main():
@@ -26,7 +27,9 @@ def main():
         - arg1: trading_cost_limit (What is the max allocated trading cost allowed) 
         - arg2: trading_rate (What is the trading rate for every transaction)
         - arg3: tolerance (What is the tolerance for the optimizer)
-        - arg4: portfolio_name (csv filename for stock portfolio; formatted as list of dictionaries)
+        - arg4: portfolio_name (csv filename for stock portfolio; one row per stock)
+        - arg5 (optional): precision (32 or 64; float precision of portfolio arrays and projection optimizer, defaults to 64)
+        - arg6 (optional): method (optimizer method: projection, quadprog or SLSQP, defaults to projection)
     - Determines if target_weights in stock portfolio are valid (sum of target_weights should add up to 1)
     - Calculate total trading fee to rebalance portfolio back to target_weights and show data collected
     - If total trading fee is at most the limit, then target weights are the holding weights
@@ -38,58 +41,45 @@ def main():
     trading_rate = float(sys.argv[2])       # Get rate for trading stocks (0.03)
     tolerance = float(sys.argv[3])          # Get tolerance in optimizer (0.0001, or put 0.0 if no tolerance)
     portfolio_name = str(sys.argv[4])       # Get csv filename to access stock portfolio
+    precision = int(sys.argv[5]) if len(sys.argv) > 5 else 64 # Get float precision of portfolio arrays (32 or 64)
+    if (precision not in (32, 64)):
+        raise Exception(f"ERROR: precision must be 32 or 64\nCurrently set to: {precision}")
+    float_dtype = np.float32 if precision == 32 else np.float64
+    method = str(sys.argv[6]) if len(sys.argv) > 6 else 'projection' # Get optimizer method (see optimize_holdings)
+    if (method not in ('projection', 'quadprog', 'SLSQP')):
+        raise Exception(f"ERROR: method must be projection, quadprog or SLSQP\nCurrently set to: {method}")
 
     '''
     Get stock data from CSV files
-    Stock portfolio is a list of dictionaries; each dictionary is a stock and its data
+    Stock portfolio is a DataFrame; each row is a stock and each column is one field of stock data
+    (columns are accessed as contiguous np.arrays rather than per-stock dictionaries)
     Format of porfolio is as follows:
-    [
-        {
-            "stock_name": 'A',          # Stock
-            "t0_stock_price": 100.0,    # t0 Price
-            "units_held": 5000.0,       # t0 Units Held
-            "t1_stock_price": 63.0,     # t1 Price
-            "target_weight": 0.4,       # t1 Target Weight
-            "holding_weight": -1        # t1 Holding Weight
-        },
-        ...
-    ]
+        stock_name      # Stock ('A')
+        t0_stock_price  # t0 Price (100.0)
+        units_held      # t0 Units Held (5000.0)
+        t1_stock_price  # t1 Price (63.0)
+        target_weight   # t1 Target Weight (0.4)
+        holding_weight  # t1 Holding Weight (-1)
     '''
-    stock_portfolio_data = pd.read_csv(portfolio_name).to_dict(orient='records')
+    stock_portfolio_df = pd.read_csv(portfolio_name, dtype={
+        "t1_stock_price": "float64",
+        "units_held": "float64",
+        "target_weight": "float64",
+        "holding_weight": "float64"
+    })
     
-    # Checks if target weights in portfolio are valid (sum up to 1)
-    validate_port_target_vals(stock_portfolio_data)
-
-    total_curr_port_val = 0     # Total current market value of portfolio (using t1 price)
-    total_holdings = 0          # Total number of holdings in portfolio
-    target_market_val_list = [] # List of target market values for each stock holding
-    curr_market_val_list = []   # List of current market values for each stock holding
-    curr_stock_prices_list = [] # List of current stock prices
-
-    # Loop through every stock inside of the portfolio
-    for stock in stock_portfolio_data:
-        
-        # Append target_weight of stock to target_market_val_list
-        target_market_val_list.append(stock["target_weight"])
-        
-        # Append t1_stock_price of stock to curr_stock_prices_list
-        curr_stock_prices_list.append(stock["t1_stock_price"])
-
-        # Add up total number of units in each stock of portfolio
-        total_holdings += stock["units_held"]
-
-        # Calculate current market value of stock holdings
-        curr_stock_market_val = stock["t1_stock_price"] * stock["units_held"]
-
-        # Append curr_stock_market_val to curr_market_val_list
-        curr_market_val_list.append(curr_stock_market_val)
+    # Checks if target weights in portfolio are valid (sum up to 1) and get them as np.array
+    # (validated in float64 before any downcast, so float32 rounding does not fail the check)
+    target_market_val_list = validate_port_target_vals(stock_portfolio_df).astype(float_dtype, copy=False)
 
-        # Add curr_stock_market_val to total_curr_port_val to get grand total value of portfolio
-        total_curr_port_val += curr_stock_market_val
+    # Pull each column out of the DataFrame as np.array (no per-stock Python loop)
+    curr_stock_prices_list = stock_portfolio_df["t1_stock_price"].to_numpy(dtype=float_dtype) # Current (t1) stock prices
+    units_held_list = stock_portfolio_df["units_held"].to_numpy(dtype=float_dtype)            # Units held of each stock
 
-    # Convert lists to np.array
-    target_market_val_list = np.array(target_market_val_list)
-    curr_market_val_list = np.array(curr_market_val_list)
+    # Totals are always accumulated in float64 (as Python floats, so arrays keep float_dtype)
+    total_holdings = float(units_held_list.sum(dtype=np.float64))              # Total number of holdings in portfolio
+    curr_market_val_list = curr_stock_prices_list * units_held_list            # Current market values for each stock holding
+    total_curr_port_val = float(curr_market_val_list.sum(dtype=np.float64))    # Total current market value of portfolio (using t1 price)
 
     # Divide each holding by the total to get current holding weights for each stock in portfolio
     curr_portfolio_weight_list = curr_market_val_list / total_curr_port_val
@@ -105,7 +95,7 @@ def main():
 
     # Calculate trading costs/fees for each transaction
     trading_fees = np.absolute(amt_exchange_list * trading_rate) # Calculate fee for every transaction
-    total_fee = np.sum(trading_fees) # Get total of all transaction fees
+    total_fee = trading_fees.sum(dtype=np.float64) # Get total of all transaction fees
 
     print("\n----- STOCK PORTFOLIO DATA -----")
     print("Current t1 Weights:", curr_portfolio_weight_list)
@@ -123,8 +113,7 @@ def main():
     if (total_fee <= trading_cost_limit):
         # If total_fee is within the limit, holding_weight should be the same as target_weight
         print("\n----- TRADING FEE IS WITHIN LIMIT -----\n")
-        for stock in stock_portfolio_data:
-            stock["holding_weight"] = stock["target_weight"]
+        new_holdings = stock_portfolio_df["target_weight"].to_numpy() # float64 targets as read, not downcast copy
     else:
         # Otherwise, we need to optimize holding weights to be within the limit
         print("\n----- TRADING FEE EXCEEDS LIMIT -----\n")
@@ -132,14 +121,16 @@ def main():
         # Perform optimization
         print("Running Optimizer...")
         new_holdings = optimize_holdings(
-            weight_dev, 
+            weight_dev_with_grad, 
             curr_portfolio_weight_list,
             target_market_val_list, 
             curr_stock_prices_list, 
             total_holdings, 
             trading_cost_limit, 
             trading_rate,
-            tolerance)
+            tolerance,
+            min_func_jac=True, # weight_dev_with_grad returns (value, gradient); used by SLSQP method
+            method=method)
         
         print("Optimized Holdings: ", new_holdings) # Show optimal holdings
         print("Updated Trading Fee:", 
@@ -150,17 +141,15 @@ def main():
                 total_holdings, 
                 trading_rate), "\n") # Show updated trading fee with optimal holdings
 
-        # Update dictionary "holding_weight" with new_holdings data for each stock
-        for index in range(len(stock_portfolio_data)):
-            stock_portfolio_data[index]["holding_weight"] = new_holdings[index]
+    # Update "holding_weight" column with new_holdings data for all stocks in one assignment
+    stock_portfolio_df["holding_weight"] = new_holdings
 
     # Print out holding answer for each stock
     print("----- ANSWER -----\n")
     print("Holding weights for each stock in portfolio should be rebalanced to:")
-    for stock in stock_portfolio_data:
-        stock_name = stock["stock_name"]
-        stock_holding_weight = stock["holding_weight"]
-        print(f"Stock {stock_name}: {stock_holding_weight}")
+    # (holding weights are printed as np values so float32 answers show float32 precision, not float64 noise)
+    for stock_name, holding_weight in zip(stock_portfolio_df["stock_name"], stock_portfolio_df["holding_weight"].to_numpy()):
+        print(f"Stock {stock_name}:", holding_weight)
         
 if __name__ == '__main__':
     main()
\ No newline at end of file
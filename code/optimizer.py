@@ -1,8 +1,233 @@
-from calculation import total_trading_cost
 import numpy as np
 from scipy.optimize import minimize, Bounds
+import types
 
-def optimize_holdings(min_func, port_weights, target_weights, prices, total_holdings, cons_trading_limit, trading_rate, tolerance):
+# Loop used over batch rows; numba.prange in the compiled projection solver (see compiled_projection_solver)
+prange = range
+
+# Numba compiled project_holdings_batch, built on first use by compiled_projection_solver
+_compiled_batch_solver = None
+
+try:
+    import quadprog
+except ImportError: # quadprog is optional; optimize_holdings falls back to SLSQP without it
+    quadprog = None
+
+# Max number of bisection steps on the trade limit multiplier in project_holdings
+MAX_BISECTION_ITERS = 200
+
+def project_simplex(v):
+    '''
+    Euclidean projection of v onto the probability simplex {w : sum(w) = 1, w >= 0}
+    (Ref: Duchi et al., "Efficient Projections onto the l1-Ball for Learning in High Dimensions")
+        v: weights to project
+    '''
+    sorted_v = np.sort(v)[::-1]
+    cumsum_v = np.cumsum(sorted_v) - 1.0
+    rho = np.nonzero(sorted_v - cumsum_v / np.arange(1, len(v) + 1) > 0)[0][-1]
+    theta = cumsum_v[rho] / (rho + 1.0)
+    return np.maximum(v - theta, 0.0).astype(v.dtype) # Keep input precision (float32 or float64)
+
+def shrink_weights(target_weights, curr_weights, shrink, shift):
+    '''
+    Minimizer of (w - target)^2 + 2 * shrink * |w - curr| + 2 * shift * w for each weight, clipped to [0, 1]
+    (target weights moved by shift, then soft-thresholded towards curr weights by shrink)
+        target_weights: weights we want to adjust to
+        curr_weights: original weights of portfolio
+        shrink: per-stock soft-threshold amount (trade limit multiplier * scaled prices / 2)
+        shift: amount subtracted from every target weight so that weights sum up to 1
+    '''
+    weight_diff_list = target_weights - shift - curr_weights
+    adj_weights = curr_weights + np.sign(weight_diff_list) * np.maximum(np.abs(weight_diff_list) - shrink, 0.0)
+    return np.clip(adj_weights, 0.0, 1.0).astype(target_weights.dtype) # Keep input precision (float32 or float64)
+
+def project_shrunk_simplex(target_weights, curr_weights, shrink):
+    '''
+    Solve min ||w - target||^2 + 2 * sum(shrink * |w - curr|) for w on the probability simplex.
+    Sum of shrink_weights(...) is piecewise linear and non-increasing in shift, so the shift making
+    weights sum up to 1 is found exactly by binary search over the sorted breakpoints
+        target_weights: weights we want to adjust to
+        curr_weights: original weights of portfolio
+        shrink: per-stock soft-threshold amount
+    '''
+    # Shifts where each weight starts/stops moving (hits 1, reaches curr from above/below, hits 0)
+    breakpoints = np.sort(np.concatenate((
+        target_weights - shrink - 1.0,
+        target_weights - curr_weights - shrink,
+        target_weights - curr_weights + shrink,
+        target_weights + shrink
+    )))
+
+    # Excess sum of weights at a shift (>= 0 at first breakpoint, < 0 at last breakpoint)
+    def excess_sum(shift):
+        return np.sum(shrink_weights(target_weights, curr_weights, shrink, shift)) - 1.0
+
+    lo, hi = 0, len(breakpoints) - 1
+    lo_excess, hi_excess = excess_sum(breakpoints[lo]), excess_sum(breakpoints[hi])
+    while (hi - lo > 1):
+        mid = (lo + hi) // 2
+        mid_excess = excess_sum(breakpoints[mid])
+        if (mid_excess >= 0):
+            lo, lo_excess = mid, mid_excess
+        else:
+            hi, hi_excess = mid, mid_excess
+
+    # Sum is linear between neighbouring breakpoints, so interpolate to the exact shift
+    shift = breakpoints[lo] + lo_excess * (breakpoints[hi] - breakpoints[lo]) / (lo_excess - hi_excess)
+    return shrink_weights(target_weights, curr_weights, shrink, shift)
+
+def project_holdings(port_weights, target_weights, scaled_prices, cons_trading_limit, tolerance):
+    '''
+    Closed-form solver for min ||w - target||^2 s.t. sum(w) = 1, 0 <= w <= 1, |w - curr| @ scaled_prices <= limit
+    (Lagrangian of the trade limit gives project_shrunk_simplex; its trading cost is non-increasing
+    in the multiplier, so the smallest multiplier within the limit is found by bisection)
+        port_weights: current weights in portfolio (should sum up to 1; otherwise weights close to them
+                      within the trade limit are returned, which then do not sum up to exactly 1)
+        target_weights: target weights (we want port_weights to adjust to be as close to)
+        scaled_prices: fee per unit of weight change for each stock (prices * total_holdings * trading_rate)
+        cons_trading_limit: total trading limit contraint
+        tolerance: stop once trading cost is within tolerance * cons_trading_limit below the limit
+    '''
+    def trade_cost(adj_weights):
+        return np.abs(adj_weights - port_weights) @ scaled_prices
+
+    # Without the trade limit, the answer is the target weights projected onto the simplex
+    adj_weights = project_simplex(target_weights)
+    if (trade_cost(adj_weights) <= cons_trading_limit):
+        return adj_weights
+    if (cons_trading_limit <= 0):
+        return port_weights.copy() # No trade is affordable, so keep current weights
+
+    # Find a multiplier large enough to be within the trade limit
+    mult_lo = 0.0
+    mult_hi = 1.0 / np.max(scaled_prices)
+    hi_weights = project_shrunk_simplex(target_weights, port_weights, mult_hi * scaled_prices / 2.0)
+    while (trade_cost(hi_weights) > cons_trading_limit):
+        mult_lo = mult_hi
+        mult_hi *= 2.0
+        hi_weights = project_shrunk_simplex(target_weights, port_weights, mult_hi * scaled_prices / 2.0)
+
+    # Bisect on multiplier, keeping hi_weights within the trade limit
+    for _ in range(MAX_BISECTION_ITERS):
+        if (cons_trading_limit - trade_cost(hi_weights) <= tolerance * cons_trading_limit):
+            break
+        mult_mid = (mult_lo + mult_hi) / 2.0
+        if (mult_mid <= mult_lo or mult_mid >= mult_hi):
+            break # Multiplier cannot be narrowed down any further in floating point
+        mid_weights = project_shrunk_simplex(target_weights, port_weights, mult_mid * scaled_prices / 2.0)
+        if (trade_cost(mid_weights) <= cons_trading_limit):
+            mult_hi, hi_weights = mult_mid, mid_weights
+        else:
+            mult_lo = mult_mid
+
+    return hi_weights
+
+def project_holdings_batch(port_weights, target_weights, scaled_prices, cons_trading_limits, tolerance):
+    '''
+    Run project_holdings for every portfolio (row) of B x N arrays; rows are solved in parallel when compiled
+    with numba (see compiled_projection_solver)
+        port_weights: current weights of each portfolio (B x N)
+        target_weights: target weights of each portfolio (B x N)
+        scaled_prices: fee per unit of weight change for each stock of each portfolio (B x N)
+        cons_trading_limits: total trading limit contraint of each portfolio (B)
+        tolerance: stop once trading cost is within tolerance * cons_trading_limit below the limit
+    '''
+    adj_weights = np.empty_like(port_weights)
+    for b in prange(port_weights.shape[0]):
+        adj_weights[b] = project_holdings(port_weights[b], target_weights[b], scaled_prices[b],
+                                          cons_trading_limits[b], tolerance)
+    return adj_weights
+
+def compiled_projection_solver():
+    '''
+    Numba compiled version of project_holdings_batch (compiled on first call and kept for later calls), with batch
+    rows spread across cores. Module functions stay plain NumPy: the compiled copies call each other through their
+    own globals. Only worth it for batches: compiling takes far longer than solving a single portfolio with NumPy.
+    Returns compiled project_holdings_batch, or None if numba is not installed
+    '''
+    global _compiled_batch_solver
+    if _compiled_batch_solver is not None:
+        return _compiled_batch_solver # Already compiled
+    try:
+        import numba
+    except ImportError: # numba is optional
+        return None
+
+    # Copy each solver function with globals where its callees (and prange) are the compiled versions
+    compiled_globals = dict(globals(), prange=numba.prange)
+    for func in (project_simplex, shrink_weights, project_shrunk_simplex, project_holdings, project_holdings_batch):
+        func_copy = types.FunctionType(func.__code__, compiled_globals, func.__name__, func.__defaults__)
+        compiled_globals[func.__name__] = numba.njit(cache=True, parallel=(func is project_holdings_batch))(func_copy)
+    _compiled_batch_solver = compiled_globals[project_holdings_batch.__name__]
+    return _compiled_batch_solver
+
+def solve_holdings_qp(port_weights, target_weights, scaled_prices, cons_trading_limit):
+    '''
+    Solve min ||w - target||^2 s.t. sum(w) = 1, 0 <= w <= 1, |w - curr| @ scaled_prices <= limit with quadprog.
+    Absolute value is made linear by splitting w - curr = buy - sell (buy, sell >= 0), so the QP is over
+    x = [w, buy, sell] with trade limit scaled_prices @ (buy + sell) <= limit
+        port_weights: current weights in portfolio (must sum up to 1, otherwise quadprog may raise ValueError)
+        target_weights: target weights (we want port_weights to adjust to be as close to)
+        scaled_prices: fee per unit of weight change for each stock (prices * total_holdings * trading_rate)
+        cons_trading_limit: total trading limit contraint
+    '''
+    if (cons_trading_limit <= 0):
+        return port_weights.copy() # No trade is affordable, so keep current weights
+
+    num_stocks = len(port_weights)
+    identity = np.eye(num_stocks)
+    zeros = np.zeros((num_stocks, num_stocks))
+
+    # quadprog minimizes 1/2 x^T G x - a^T x; G needs to be positive definite, so buy/sell get a tiny ridge
+    quad_matrix = np.diag(np.concatenate((np.ones(num_stocks), np.full(2 * num_stocks, 1e-9))))
+    linear_vec = np.concatenate((target_weights, np.zeros(2 * num_stocks)))
+
+    # Constraints are columns of C with C^T x >= b (first num_stocks + 1 are equalities)
+    cons_matrix = np.hstack((
+        np.concatenate((np.ones(num_stocks), np.zeros(2 * num_stocks)))[:, np.newaxis], # sum(w) = 1
+        np.vstack((identity, -identity, identity)),                                     # w - buy + sell = curr
+        np.vstack((identity, zeros, zeros)),                                             # w >= 0
+        np.vstack((-identity, zeros, zeros)),                                            # -w >= -1
+        np.vstack((zeros, identity, zeros)),                                             # buy >= 0
+        np.vstack((zeros, zeros, identity)),                                             # sell >= 0
+        np.concatenate((np.zeros(num_stocks), -scaled_prices / cons_trading_limit,
+                        -scaled_prices / cons_trading_limit))[:, np.newaxis]            # trade limit (scaled to 1)
+    ))
+    cons_vec = np.concatenate(([1.0], port_weights, np.zeros(num_stocks), -np.ones(num_stocks),
+                               np.zeros(2 * num_stocks), [-1.0]))
+
+    solution = quadprog.solve_qp(quad_matrix, linear_vec, cons_matrix, cons_vec, meq=num_stocks + 1)[0]
+    return np.clip(solution[:num_stocks], 0.0, 1.0)
+
+def check_sum_weights(trade_weights):
+    '''
+    Constraint function for SLSQP: weights must sum up to 1 (equality constraint is 0 when they do);
+    current weights already sum up to 1, so this holds when weight bought equals weight sold
+        trade_weights: weight bought and sold of each stock ([buy, sell]) being adjusted in optimizer
+    '''
+    buy_weights, sell_weights = np.split(trade_weights, 2)
+    return np.sum(sell_weights) - np.sum(buy_weights)
+
+def check_sum_weights_jac(trade_weights):
+    '''
+    Gradient of check_sum_weights with respect to trade_weights (constant: -1 for each buy, 1 for each sell)
+        trade_weights: weight bought and sold of each stock ([buy, sell]) being adjusted in optimizer
+    '''
+    num_stocks = len(trade_weights) // 2
+    return np.concatenate((np.full(num_stocks, -1.0), np.ones(num_stocks)))
+
+def solver_dtype(method, *arrays):
+    '''
+    Float dtype optimizer runs in: projection solver keeps float32 if all input arrays are float32
+    (halves memory traffic); SLSQP and quadprog always run in float64
+        method: optimizer method ('projection', 'quadprog' or 'SLSQP')
+        arrays: optimizer input arrays (weights, prices)
+    '''
+    if (method == 'projection' and all(np.asarray(arr).dtype == np.float32 for arr in arrays)):
+        return np.float32
+    return np.float64
+
+def optimize_holdings(min_func, port_weights, target_weights, prices, total_holdings, cons_trading_limit, trading_rate, tolerance, min_func_jac=None, method='projection', verbose=False):
     '''
     Optimizer Function (Ref: https://towardsdatascience.com/portfolio-optimization-with-scipy-aa9c02e6b937)
         min_func: function we want to minimize on (in this case, minimize weight deviation)
@@ -13,38 +238,150 @@ def optimize_holdings(min_func, port_weights, target_weights, prices, total_hold
         cons_trading_limit: total trading limit contraint
         trading_rate: rate/free for every stock transaction; used for constraint function
         tolerance: optimizer tolerance
+        min_func_jac: gradient of min_func, or True if min_func returns (value, gradient) (if None, optimizer estimates it with finite differences)
+        method: 'projection' to use closed-form project_holdings solver (min_func is not used),
+                'quadprog' to use solve_holdings_qp QP solver (min_func is not used; falls back to 'SLSQP'
+                if quadprog is not installed), or 'SLSQP' to minimize min_func with scipy
+        verbose: if True, print full SLSQP optimizer result
     '''
-    opt_bounds = Bounds(0.0, 1.0) # Set bounds for weights to be between 0 and 1
+    # Convert inputs once to contiguous float arrays so no per-call conversions happen inside optimizer
+    float_dtype = solver_dtype(method, port_weights, target_weights, prices)
+    port_weights = np.ascontiguousarray(port_weights, dtype=float_dtype)
+    target_weights = np.ascontiguousarray(target_weights, dtype=float_dtype)
+    prices = np.ascontiguousarray(prices, dtype=float_dtype)
+
+    # Normalise current weights to sum up to 1, so keeping them is always feasible (e.g. for a tiny trade limit)
+    port_weights = port_weights / np.sum(port_weights)
+
     save_curr_weights = port_weights # Save port_weights for checking trade limit
 
-    # Contraint function to check trade limit
-    def check_trade_limit(port_weights):
-        limit = cons_trading_limit - (total_trading_cost(
-                    curr_weights=save_curr_weights, 
-                    adj_weights=port_weights,
-                    prices=prices,
-                    total_holdings=total_holdings,
-                    trading_rate=trading_rate
-                    ))
-        # print("check_trade_limit:", limit)
-        return limit
+    # Fee per unit of weight change for each stock; constant across optimizer iterations so compute once
+    scaled_prices = (prices * total_holdings * trading_rate).astype(float_dtype, copy=False)
+
+    # Skip optimizer if portfolio is already at target weights, or rebalancing to target is within the limit
+    if np.allclose(port_weights, target_weights, rtol=0.0, atol=1e-12):
+        return target_weights.copy()
+    if (np.abs(target_weights - port_weights) @ scaled_prices <= cons_trading_limit):
+        return target_weights.copy()
+
+    if (method == 'projection'):
+        return project_holdings(save_curr_weights, target_weights, scaled_prices, cons_trading_limit, tolerance)
+    if (method == 'quadprog'):
+        if quadprog is not None:
+            try:
+                return solve_holdings_qp(save_curr_weights, target_weights, scaled_prices, cons_trading_limit)
+            except ValueError: # quadprog raises ValueError if it finds the constraints inconsistent
+                pass
+        method = 'SLSQP' # Fallback to SLSQP if quadprog is not installed or fails
+    if (method != 'SLSQP'):
+        raise Exception(f"ERROR: unknown optimizer method: {method}")
+    if (cons_trading_limit <= 0):
+        return save_curr_weights.copy() # No trade is affordable, so keep current weights (as other methods do)
+
+    # |w - curr| @ scaled_prices is not differentiable at w = curr, where SLSQP starts, so its gradient there is 0
+    # and SLSQP stops short of the optimum. Like solve_holdings_qp, split w - curr = buy - sell (buy, sell >= 0) and
+    # optimize over trade_weights = [buy, sell] instead: the trade limit becomes linear, and bounds
+    # 0 <= buy <= 1 - curr, 0 <= sell <= curr keep weights between 0 and 1
+    num_stocks = len(save_curr_weights)
+    trade_bounds = Bounds(0.0, np.concatenate((1.0 - save_curr_weights, save_curr_weights)))
+    trade_prices = np.concatenate((scaled_prices, scaled_prices)) # Fee per unit of weight bought or sold
+
+    # Portfolio weights after buying and selling trade_weights
+    def trades_to_weights(trade_weights, curr_weights=save_curr_weights):
+        return curr_weights + trade_weights[:num_stocks] - trade_weights[num_stocks:]
+
+    # min_func of the traded weights; its gradient with respect to [buy, sell] is [grad, -grad]
+    def trade_min_func(trade_weights, target_weights):
+        result = min_func(trades_to_weights(trade_weights), target_weights)
+        if (min_func_jac is True):
+            value, grad = result
+            return value, np.concatenate((grad, -grad))
+        return result
+
+    trade_min_func_jac = min_func_jac # True or None are passed on as they are
+    if callable(min_func_jac):
+        def trade_min_func_jac(trade_weights, target_weights):
+            grad = min_func_jac(trades_to_weights(trade_weights), target_weights)
+            return np.concatenate((grad, -grad))
+
+    # Contraint function to check trade limit (same as cons_trading_limit - total_trading_cost(...))
+    # Arrays are bound as default arguments so they are local lookups instead of closure cell lookups
+    def check_trade_limit(trade_weights, trade_prices=trade_prices):
+        return cons_trading_limit - trade_weights @ trade_prices
+
+    # Gradient of check_trade_limit with respect to trade_weights is constant
+    def check_trade_limit_jac(trade_weights, trade_prices=trade_prices):
+        return -trade_prices
 
     # Set our constraints for the optimization
     opt_constraints = [
-        {'type': 'eq', 'fun': lambda port_weights: 1.0 - (np.sum(port_weights))}, # Weights must sum up to 1
-        {'type': 'ineq', 'fun': lambda port_weights: check_trade_limit(port_weights)} # Total trading fees must not exceed limit
+        {'type': 'eq', 'fun': check_sum_weights,
+         'jac': check_sum_weights_jac}, # Weights must sum up to 1
+        {'type': 'ineq', 'fun': check_trade_limit,
+         'jac': check_trade_limit_jac} # Total trading fees must not exceed limit
     ]
     
-    # Calculate optimal weights with the constraints
-    optimal_weights = minimize(min_func, port_weights, 
+    # Start part of the way from current to target weights, using up exactly the trade limit (feasible, and
+    # closer to target than not trading; limit is below full rebalance cost here, so the fraction is below 1)
+    target_diff = target_weights - save_curr_weights
+    start_diff = target_diff * (cons_trading_limit / (np.abs(target_diff) @ scaled_prices))
+    start_trades = np.concatenate((np.maximum(start_diff, 0.0), np.maximum(-start_diff, 0.0)))
+
+    # Calculate optimal trades with the constraints
+    optimal_weights = minimize(trade_min_func, start_trades, 
                                args=(target_weights),
+                               jac=trade_min_func_jac,
                                method='SLSQP',
-                               bounds=opt_bounds,
+                               bounds=trade_bounds,
                                constraints=opt_constraints,
                                tol=tolerance
                                )
-    
-    print(optimal_weights)
+
+    if verbose:
+        print(optimal_weights)
 
     # Return optimal weights of portfolio
-    return optimal_weights['x']
+    return trades_to_weights(optimal_weights['x'])
+
+def optimize_holdings_batch(port_weights, target_weights, prices, total_holdings, cons_trading_limit, trading_rate, tolerance, use_numba=True):
+    '''
+    Batch Optimizer Function: rebalance many portfolios at once with the projection solver
+        port_weights: current weights of each portfolio (B x N)
+        target_weights: target weights of each portfolio (B x N)
+        prices: latest (t1) market prices for stocks of each portfolio (B x N, or N if shared)
+        total_holdings: total holdings (units) of each portfolio (B, or scalar if shared)
+        cons_trading_limit: total trading limit contraint of each portfolio (B, or scalar if shared)
+        trading_rate: rate/free for every stock transaction
+        tolerance: optimizer tolerance
+        use_numba: if True, solve rows in parallel with the numba compiled projection solver (if numba is installed)
+    '''
+    float_dtype = solver_dtype('projection', port_weights, target_weights, prices)
+    port_weights = np.ascontiguousarray(port_weights, dtype=float_dtype)
+    target_weights = np.ascontiguousarray(target_weights, dtype=float_dtype)
+    if (port_weights.ndim != 2 or target_weights.shape != port_weights.shape):
+        raise Exception(f"ERROR: port_weights and target_weights must both be B x N arrays\n"
+                        f"Currently shaped: {port_weights.shape} and {target_weights.shape}")
+    num_portfolios = port_weights.shape[0]
+
+    # Normalise current weights of each portfolio to sum up to 1 (see optimize_holdings)
+    port_weights = port_weights / np.sum(port_weights, axis=1, keepdims=True)
+
+    total_holdings = np.broadcast_to(np.asarray(total_holdings, dtype=np.float64), (num_portfolios,))
+    cons_trading_limit = np.ascontiguousarray(
+        np.broadcast_to(np.asarray(cons_trading_limit, dtype=np.float64), (num_portfolios,)))
+    prices = np.broadcast_to(np.asarray(prices, dtype=float_dtype), port_weights.shape)
+
+    # Fee per unit of weight change for each stock of each portfolio
+    scaled_prices = np.ascontiguousarray(prices * total_holdings[:, np.newaxis] * trading_rate, dtype=float_dtype)
+
+    # Single portfolio is solved with the same project_holdings as the batch rows, without compiling
+    if (num_portfolios == 1):
+        return project_holdings(port_weights[0], target_weights[0], scaled_prices[0],
+                                cons_trading_limit[0], float(tolerance))[np.newaxis, :]
+
+    # Use compiled solver only when asked for; module functions are never replaced, so use_numba=False stays NumPy
+    batch_solver = compiled_projection_solver() if use_numba else None
+    if batch_solver is None:
+        batch_solver = project_holdings_batch
+
+    return batch_solver(port_weights, target_weights, scaled_prices, cons_trading_limit, float(tolerance))